@@ -1,5 +1,9 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pac
 import glob
+from concurrent.futures import ProcessPoolExecutor
 
 # Patient → (Gene, Ancestry)
 patient_regions = {
@@ -35,26 +39,48 @@ patient_regions = {
     "WG0366": ("ZNF808", "Sudanese")
 }
 
+# Patient → Gene
+gene_map = {k: v[0] for k, v in patient_regions.items()}
+
+# Shared-region TSV columns and their types
+COLUMNS = [
+    "chrom", "start", "end", "num_vars", "num_inds", "inds_str",
+    "mode", "err_left", "err_right", "n_ultra_rare", "ultra_rare_label"
+]
+SCHEMA = {
+    "chrom": pa.string(),
+    "start": pa.int32(),
+    "end": pa.int32(),
+    "num_vars": pa.int32(),
+    "num_inds": pa.int32(),
+    "inds_str": pa.string(),
+    "mode": pa.string(),
+    "err_left": pa.float64(),   # "None" when there is no flanking variant
+    "err_right": pa.float64(),
+    "n_ultra_rare": pa.int32(),
+    "ultra_rare_label": pa.string()
+}
+
 def process_file(file_path):
     # Read TSV file
-    df = pd.read_csv(file_path, sep="\t", header=None)
-    
-    # Name columns
-    df.columns = [
-        "chrom", "start", "end", "num_vars", "num_inds", "inds_str",
-        "mode", "err_left", "err_right", "n_ultra_rare", "ultra_rare_label"
-    ]
-    
-    # Split patient list and assign match status
-    def get_match_status(inds):
-        genes = set()
-        for ind in inds:
-            gene = patient_regions.get(ind, ("UNKNOWN",))[0]
-            genes.add(gene)
-        return "TRUE_MATCH" if len(genes) == 1 else "NO_MATCH"
+    tbl = pac.read_csv(
+        file_path,
+        parse_options=pac.ParseOptions(delimiter="\t"),
+        read_options=pac.ReadOptions(column_names=COLUMNS, use_threads=True),
+        convert_options=pac.ConvertOptions(column_types=SCHEMA, null_values=["None"])
+    )
+    df = tbl.to_pandas()
     
-    df["inds_list"] = df["inds_str"].apply(lambda x: [i.strip() for i in x.split(",") if i.strip()])
-    df["match_status"] = df["inds_list"].apply(get_match_status)
+    # Split each distinct patient list once and broadcast its match status
+    uniq = df["inds_str"].drop_duplicates().reset_index(drop=True)
+    s = uniq.str.split(",", expand=False).explode().str.strip()
+    s = s[s != ""].astype("category")
+    # Map each patient category to an integer gene code so nunique runs over ints
+    gene_codes = pd.factorize(s.cat.categories.map(gene_map).fillna("UNKNOWN"))[0]
+    g = pd.Series(gene_codes[s.cat.codes.to_numpy()], index=s.index)
+    nunique = g.groupby(level=0).nunique().reindex(uniq.index, fill_value=0)
+    status_map = dict(zip(uniq, np.where(nunique == 1, "TRUE_MATCH", "NO_MATCH")))
+    df["match_status"] = df["inds_str"].map(status_map)
     
     # Calculate percentage true match
     total_entries = len(df)
@@ -68,23 +94,22 @@ def process_file(file_path):
         "true_match_percent": true_match_percent
     }
 
-# Find all matching files
-file_pattern = "shared_regions_dist*_vars*_rare*_no_gene_filter.tsv"
-matching_files = glob.glob(file_pattern)
+if __name__ == "__main__":
+    # Find all matching files
+    file_pattern = "shared_regions_dist*_vars*_rare*_no_gene_filter.tsv"
+    matching_files = glob.glob(file_pattern)
 
-# Process all files and collect results
-results = []
-for file_path in matching_files:
-    result = process_file(file_path)
-    results.append(result)
+    # Process all files and collect results
+    with ProcessPoolExecutor() as ex:
+        results = list(ex.map(process_file, matching_files))
 
-# Create summary DataFrame
-summary_df = pd.DataFrame(results)
+    # Create summary DataFrame
+    summary_df = pd.DataFrame(results)
 
-# Print and save results
-print("\nSummary of true matches across all files:")
-print(summary_df[["file_name", "total_entries", "true_match_count", "true_match_percent"]].to_string(index=False))
+    # Print and save results
+    print("\nSummary of true matches across all files:")
+    print(summary_df[["file_name", "total_entries", "true_match_count", "true_match_percent"]].to_string(index=False))
 
-# Save detailed results to CSV
-summary_df.to_csv("shared_regions_match_summary.csv", index=False)
-print("\nDetailed results saved to 'shared_regions_match_summary.csv'")
\ No newline at end of file
+    # Save detailed results to CSV
+    summary_df.to_csv("shared_regions_match_summary.csv", index=False)
+    print("\nDetailed results saved to 'shared_regions_match_summary.csv'")
\ No newline at end of file
@@ -1,5 +1,6 @@
 import pandas as pd
-from collections import defaultdict
+import ahocorasick
+from collections import Counter
 
 def load_disease_mapping(cohort_file):
     """Load patient to disease mapping, focusing on NDM cases"""
@@ -22,9 +23,19 @@ def load_disease_mapping(cohort_file):
 def process_shared_regions(shared_file, patient_disease):
     """Process shared regions focusing only on NDM patients"""
     regions_data = []
+    if not patient_disease:
+        return pd.DataFrame(regions_data)
+    
+    # Automaton over all NDM patient IDs, used to skip lines without any of them
+    automaton = ahocorasick.Automaton()
+    for pid in patient_disease:
+        automaton.add_word(pid, pid)
+    automaton.make_automaton()
     
     with open(shared_file, 'r') as f:
         for line in f:
+            if next(automaton.iter(line), None) is None:
+                continue
             parts = line.strip().split('\t')
             if len(parts) >= 6:
                 chrom = parts[0]
@@ -35,12 +46,9 @@ def process_shared_regions(shared_file, patient_disease):
                 # Only process regions shared by NDM patients
                 if len(patients) > 0:
                     # Get disease status for these patients
-                    patient_diseases = []
-                    disease_counts = defaultdict(int)
-                    for p in patients:
-                        disease = patient_disease[p]
-                        patient_diseases.append(f"{p}({disease})")
-                        disease_counts[disease] += 1
+                    diseases = [patient_disease[p] for p in patients]
+                    disease_counts = Counter(diseases)
+                    patient_diseases = [f"{p}({d})" for p, d in zip(patients, diseases)]
                     
                     regions_data.append({
                         'Chromosome': chrom,
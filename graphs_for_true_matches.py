@@ -1,131 +1,152 @@
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pac
 import matplotlib.pyplot as plt
 import seaborn as sns
 import glob
+from concurrent.futures import ProcessPoolExecutor
 import re
 
-# Load all TSV files matching pattern
-files = glob.glob("shared_regions_dist*_vars*_rare*_no_gene_filter.tsv")
-
 # Pattern to extract parameters
 pattern = re.compile(r"dist(\d+)_vars(\d+)_rare([\d.]+)")
 
-results = []
-
-for file in files:
+# Shared-region TSV columns and their types
+COLUMNS = [
+    "chrom", "start", "end", "n_variants", "n_individuals", "individuals",
+    "mode", "err_left", "err_right", "n_ultra_rare", "filter"
+]
+SCHEMA = {
+    "chrom": pa.string(),
+    "start": pa.int32(),
+    "end": pa.int32(),
+    "n_variants": pa.int32(),
+    "n_individuals": pa.int32(),
+    "individuals": pa.string(),
+    "mode": pa.string(),
+    "err_left": pa.float64(),   # "None" when there is no flanking variant
+    "err_right": pa.float64(),
+    "n_ultra_rare": pa.int32(),
+    "filter": pa.string()
+}
+
+def process_file(file):
     match = pattern.search(file)
-    if match:
-        dist, vars_, rare = match.groups()
-        df = pd.read_csv(file, sep="\t", header=None)
-        df.columns = [
-            "chrom", "start", "end", "n_variants", "n_individuals", "individuals",
-            "mode", "err_left", "err_right", "n_ultra_rare", "filter"
-        ]
-        
-        total = len(df)
-        true_matches = 0
-
-        for inds in df["individuals"]:
-            ids = inds.split(",")
-            prefixes = set(id[:5] for id in ids)
-            if len(prefixes) == 1:
-                true_matches += 1
-
-        results.append({
-            "dist": int(dist),
-            "n_vars": int(vars_),
-            "rare": float(rare),
-            "total_regions": total,
-            "true_matches": true_matches,
-            "percent_true": 100 * true_matches / total if total > 0 else 0
-        })
-
-res_df = pd.DataFrame(results)
-
-# --- Figure 1: Bar Plot ---
-plt.figure(figsize=(10, 6))
-sns.barplot(data=res_df, x="n_vars", y="percent_true", hue="dist")
-plt.title("Percentage of True Matches by Parameters")
-plt.ylabel("True Matches (%)")
-plt.xlabel("Min Variants")
-plt.legend(title="Cluster Distance")
-plt.tight_layout()
-plt.savefig("figure1_barplot.png")
-
-# --- Figure 2: Sensitivity vs Specificity ---
-plt.figure(figsize=(8, 6))
-sns.scatterplot(data=res_df, x="percent_true", y="true_matches", hue="n_vars", palette="tab10", style="dist")
-plt.title("Sensitivity vs Specificity")
-plt.xlabel("Specificity (% True Matches)")
-plt.ylabel("Sensitivity (True Match Count)")
-plt.legend(title="Min Variants / Distance")
-plt.tight_layout()
-plt.savefig("figure2_tradeoff.png")
-
-# --- Figure 3: Heatmap ---
-heatmap_data = res_df.pivot_table(values="percent_true", index="n_vars", columns="dist")
-plt.figure(figsize=(8, 6))
-sns.heatmap(heatmap_data, annot=True, fmt=".1f", cmap="YlGnBu")
-plt.title("Heatmap of True Match %")
-plt.xlabel("Cluster Distance")
-plt.ylabel("Min Variants")
-plt.tight_layout()
-plt.savefig("figure3_heatmap.png")
-
-g = sns.FacetGrid(res_df, col="dist", hue="n_vars", palette="tab20", height=5)
-g.map(sns.scatterplot, "percent_true", "true_matches", s=80)
-g.add_legend(title="Min Variants")
-g.set_axis_labels("Specificity (% True Matches)", "Sensitivity (True Match Count)")
-plt.tight_layout()
-plt.savefig("figure4_tradeoff.png")
-
-plt.figure(figsize=(10, 6))
-sns.scatterplot(
-    data=res_df,
-    x="percent_true",
-    y="true_matches",
-    hue="n_vars",
-    size="dist",
-    sizes=(50, 200),
-    palette="plasma",
-    alpha=0.8
-)
-plt.title("Parameter Impact on Detection Performance")
-plt.xlabel("Specificity (% True Matches)")
-plt.ylabel("Sensitivity (True Match Count)")
-plt.legend(bbox_to_anchor=(1.05, 1))
-plt.tight_layout()
-plt.savefig("figure5_tradeoff.png")
-
-
-# --- Figure 1: 3D Scatter Plot (Distance vs Variants vs Rare) ---
-fig = plt.figure(figsize=(12, 8))
-ax = fig.add_subplot(111, projection='3d')
-
-# Create color mapping based on percent_true
-norm = plt.Normalize(res_df['percent_true'].min(), res_df['percent_true'].max())
-colors = plt.cm.viridis(norm(res_df['percent_true']))
-
-sc = ax.scatter(
-    xs=res_df['dist'],
-    ys=res_df['n_vars'],
-    zs=res_df['rare'],
-    c=colors,
-    s=res_df['true_matches']*5,  # Size by true matches
-    alpha=0.8,
-    depthshade=False
-)
-
-ax.set_xlabel('Cluster Distance (bp)')
-ax.set_ylabel('Min Variants')
-ax.set_zlabel('Ultra-Rare Threshold')
-ax.set_title('Parameter Space Exploration (Color: % True, Size: Sensitivity)')
-
-# Add colorbar
-cbar = fig.colorbar(plt.cm.ScalarMappable(norm=norm, cmap='viridis'), ax=ax, shrink=0.5)
-cbar.set_label('% True Matches')
-
-plt.tight_layout()
-plt.savefig("figure1_3d_parameter_space.png", dpi=300)
-
-
+    if not match:
+        return None
+    dist, vars_, rare = match.groups()
+    tbl = pac.read_csv(
+        file,
+        parse_options=pac.ParseOptions(delimiter="\t"),
+        read_options=pac.ReadOptions(column_names=COLUMNS, use_threads=True),
+        convert_options=pac.ConvertOptions(column_types=SCHEMA, null_values=["None"])
+    )
+    df = tbl.to_pandas()
+    
+    total = len(df)
+    s = df["individuals"].str.split(",").explode().str.slice(0, 5)
+    true_matches = int((s.groupby(level=0).nunique() == 1).sum())
+
+    return {
+        "dist": int(dist),
+        "n_vars": int(vars_),
+        "rare": float(rare),
+        "total_regions": total,
+        "true_matches": true_matches,
+        "percent_true": 100 * true_matches / total if total > 0 else 0
+    }
+
+if __name__ == "__main__":
+    # Load all TSV files matching pattern
+    files = glob.glob("shared_regions_dist*_vars*_rare*_no_gene_filter.tsv")
+
+    with ProcessPoolExecutor() as ex:
+        results = [r for r in ex.map(process_file, files) if r is not None]
+
+    res_df = pd.DataFrame(results)
+
+    # --- Figure 1: Bar Plot ---
+    fig, ax = plt.subplots(figsize=(10, 6), constrained_layout=True)
+    sns.barplot(data=res_df, x="n_vars", y="percent_true", hue="dist", ax=ax)
+    ax.set_title("Percentage of True Matches by Parameters")
+    ax.set_ylabel("True Matches (%)")
+    ax.set_xlabel("Min Variants")
+    ax.legend(title="Cluster Distance")
+    fig.savefig("figure1_barplot.png")
+    plt.close(fig)
+
+    # --- Figure 2: Sensitivity vs Specificity ---
+    fig, ax = plt.subplots(figsize=(8, 6), constrained_layout=True)
+    sns.scatterplot(data=res_df, x="percent_true", y="true_matches", hue="n_vars", palette="tab10", style="dist", ax=ax)
+    ax.set_title("Sensitivity vs Specificity")
+    ax.set_xlabel("Specificity (% True Matches)")
+    ax.set_ylabel("Sensitivity (True Match Count)")
+    ax.legend(title="Min Variants / Distance")
+    fig.savefig("figure2_tradeoff.png")
+    plt.close(fig)
+
+    # --- Figure 3: Heatmap ---
+    heatmap_data = res_df.pivot_table(values="percent_true", index="n_vars", columns="dist")
+    fig, ax = plt.subplots(figsize=(8, 6), constrained_layout=True)
+    sns.heatmap(heatmap_data, annot=True, fmt=".1f", cmap="YlGnBu", ax=ax)
+    ax.set_title("Heatmap of True Match %")
+    ax.set_xlabel("Cluster Distance")
+    ax.set_ylabel("Min Variants")
+    fig.savefig("figure3_heatmap.png")
+    plt.close(fig)
+
+    g = sns.FacetGrid(res_df, col="dist", hue="n_vars", palette="tab20", height=5)
+    g.map(sns.scatterplot, "percent_true", "true_matches", s=80)
+    g.add_legend(title="Min Variants")
+    g.set_axis_labels("Specificity (% True Matches)", "Sensitivity (True Match Count)")
+    g.savefig("figure4_tradeoff.png")
+    plt.close(g.figure)
+
+    fig, ax = plt.subplots(figsize=(10, 6), constrained_layout=True)
+    sns.scatterplot(
+        data=res_df,
+        x="percent_true",
+        y="true_matches",
+        hue="n_vars",
+        size="dist",
+        sizes=(50, 200),
+        palette="plasma",
+        alpha=0.8,
+        ax=ax
+    )
+    ax.set_title("Parameter Impact on Detection Performance")
+    ax.set_xlabel("Specificity (% True Matches)")
+    ax.set_ylabel("Sensitivity (True Match Count)")
+    ax.legend(bbox_to_anchor=(1.05, 1))
+    fig.savefig("figure5_tradeoff.png")
+    plt.close(fig)
+
+
+    # --- Figure 1: 3D Scatter Plot (Distance vs Variants vs Rare) ---
+    fig, ax = plt.subplots(figsize=(12, 8), subplot_kw={'projection': '3d'}, constrained_layout=True)
+
+    # Color by percent_true; matplotlib applies the colormap itself
+    norm = plt.Normalize(res_df['percent_true'].min(), res_df['percent_true'].max())
+
+    sc = ax.scatter(
+        xs=res_df['dist'],
+        ys=res_df['n_vars'],
+        zs=res_df['rare'],
+        c=res_df['percent_true'],
+        cmap='viridis',
+        norm=norm,
+        s=res_df['true_matches']*5,  # Size by true matches
+        alpha=0.8,
+        depthshade=False
+    )
+
+    ax.set_xlabel('Cluster Distance (bp)')
+    ax.set_ylabel('Min Variants')
+    ax.set_zlabel('Ultra-Rare Threshold')
+    ax.set_title('Parameter Space Exploration (Color: % True, Size: Sensitivity)')
+
+    # Add colorbar
+    cbar = fig.colorbar(sc, ax=ax, shrink=0.5)
+    cbar.set_label('% True Matches')
+
+    fig.savefig("figure1_3d_parameter_space.png", dpi=300)
+    plt.close(fig)
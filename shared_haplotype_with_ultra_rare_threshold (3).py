@@ -1,55 +1,179 @@
 from __future__ import annotations
 
 import argparse
-from typing import List, Set
+from collections import defaultdict
+from typing import List
+import numpy as np
 import pandas as pd
 from cyvcf2 import VCF
+from numba import njit
 from tqdm import tqdm
 
 # --------------------------------------------------------------------------- #
 # Helper functions
 # --------------------------------------------------------------------------- #
 
-def variant_carriers(v) -> Set[int]:
-    return {i for i, gts in enumerate(v.genotypes) if any(allele > 0 for allele in gts[:2])}
+class ClusterBuf:
+    """Structure-of-arrays store for the cluster being built, reused across clusters"""
+
+    def __init__(self, n_samples: int, capacity: int = 1024):
+        self.chrom: str | None = None
+        self._n = 0
+        self._positions = np.empty(capacity, dtype=np.int64)
+        self._afs = np.empty(capacity, dtype=np.float64)
+        # cyvcf2 gt_types codes: 0=HOM_REF, 1=HET, 2=UNKNOWN, 3=HOM_ALT
+        self._gt_types = np.empty((capacity, n_samples), dtype=np.int8)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def append(self, chrom: str, pos: int, gt_types, af: float) -> None:
+        if self._n == len(self._positions):
+            self._grow()
+        if self._n == 0:
+            self.chrom = chrom
+        self._positions[self._n] = pos
+        self._gt_types[self._n] = gt_types
+        self._afs[self._n] = af
+        self._n += 1
+
+    def clear(self) -> None:
+        self.chrom = None
+        self._n = 0
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self._positions)
+        positions = np.empty(capacity, dtype=np.int64)
+        gt_types = np.empty((capacity, self._gt_types.shape[1]), dtype=np.int8)
+        afs = np.empty(capacity, dtype=np.float64)
+        positions[: self._n] = self._positions[: self._n]
+        gt_types[: self._n] = self._gt_types[: self._n]
+        afs[: self._n] = self._afs[: self._n]
+        self._positions = positions
+        self._gt_types = gt_types
+        self._afs = afs
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self._positions[: self._n]
+
+    @property
+    def gt_types(self) -> np.ndarray:
+        return self._gt_types[: self._n]
+
+    @property
+    def afs(self) -> np.ndarray:
+        return self._afs[: self._n]
+
+def variant_carriers(gts: np.ndarray) -> np.ndarray:
+    return (gts > 0) & (gts != 2)
+
+def shared_genotype_modes(gts: np.ndarray, shared_inds: np.ndarray) -> np.ndarray:
+    # Per-variant mode code for find_blocks: 1 if every shared sample is HOM_ALT ("double"), else 0
+    return (gts[:, shared_inds] == 3).all(axis=1).view(np.int8)
+
+def build_gene_index(regions: list[tuple[str, int, int]]) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    # Per chromosome: region starts sorted ascending, plus the running max of their ends
+    by_chrom: dict[str, list[tuple[int, int]]] = defaultdict(list)
+    for region_chrom, region_start, region_end in regions:
+        by_chrom[region_chrom].append((region_start, region_end))
 
-def all_shared_homozygous(v, shared_inds: Set[int]) -> bool:
-    gt = v.gt_types
-    return all(gt[i] == 3 for i in shared_inds)
+    gene_index = {}
+    for region_chrom, spans in by_chrom.items():
+        arr = np.array(sorted(spans), dtype=np.int64)
+        gene_index[region_chrom] = (arr[:, 0], np.maximum.accumulate(arr[:, 1]))
+    return gene_index
 
-def overlaps_gene_region(chrom: str, start: int, end: int, regions: list[tuple[str, int, int]]) -> bool:
+def overlaps_gene_region(chrom: str, start: int, end: int, gene_index: dict[str, tuple[np.ndarray, np.ndarray]]) -> bool:
     chrom = chrom.lstrip("chr")
-    for region_chrom, region_start, region_end in regions:
-        if chrom == region_chrom and not (end < region_start or start > region_end):
-            return True
-    return False
-
-def is_ultra_rare_variant(variant, gnomad_idx: int, af_threshold:float) -> bool:
-    csq_entries = variant.INFO.get('CSQ', '')
-    if not csq_entries:
+    if chrom not in gene_index:
         return False
+    starts, max_ends = gene_index[chrom]
+    # Regions [0, i) start at or before `end`; one of them overlaps if its end reaches `start`
+    i = np.searchsorted(starts, end, side="right")
+    return i > 0 and max_ends[i - 1] >= start
+
+NO_FLANK = -1  # stands in for a missing flanking position / error
+
+@njit(cache=True)
+def find_blocks(mode_arr):
+    # Split a per-variant mode array (1=double, 0=single) into runs of equal mode
+    n = mode_arr.shape[0]
+    starts = np.empty(n, dtype=np.int32)
+    ends = np.empty(n, dtype=np.int32)
+    modes = np.empty(n, dtype=np.int8)
+    n_blocks = 0
+    block_start = 0
+    for i in range(1, n):
+        if mode_arr[i] != mode_arr[i - 1]:
+            starts[n_blocks] = block_start
+            ends[n_blocks] = i - 1
+            modes[n_blocks] = mode_arr[block_start]
+            n_blocks += 1
+            block_start = i
+    starts[n_blocks] = block_start
+    ends[n_blocks] = n - 1
+    modes[n_blocks] = mode_arr[block_start]
+    n_blocks += 1
+    return starts[:n_blocks], ends[:n_blocks], modes[:n_blocks]
+
+@njit(cache=True)
+def block_extents(positions, starts, ends, prev_flank, next_flank):
+    # Segment length and left/right breakpoint error for every block
+    n = positions.shape[0]
+    n_blocks = starts.shape[0]
+    segment_length = np.empty(n_blocks, dtype=np.int64)
+    err_left = np.empty(n_blocks, dtype=np.int64)
+    err_right = np.empty(n_blocks, dtype=np.int64)
+    for b in range(n_blocks):
+        start = positions[starts[b]]
+        end = positions[ends[b]]
+        segment_length[b] = end - start
+        left_flank = positions[starts[b] - 1] if starts[b] > 0 else prev_flank
+        right_flank = positions[ends[b] + 1] if ends[b] + 1 < n else next_flank
+        err_left[b] = NO_FLANK if left_flank == NO_FLANK else start - left_flank
+        err_right[b] = NO_FLANK if right_flank == NO_FLANK else right_flank - end
+    return segment_length, err_left, err_right
+
+def extract_field(entry: str, idx: int) -> str | None:
+    # Walk to the idx-th '|'-separated field without splitting the whole entry
+    pos = 0
+    for _ in range(idx):
+        nxt = entry.find('|', pos)
+        if nxt < 0:
+            return None
+        pos = nxt + 1
+    end = entry.find('|', pos)
+    return entry[pos:end] if end >= 0 else entry[pos:]
+
+MISSING_AF = -1.0  # some transcript has no GnomAD AF, treated as ultra-rare
+
+def extract_gnomad_af(csq_entries: str, gnomad_idx: int) -> float:
+    # Lowest GnomAD AF across the CSQ transcript entries; inf if none is usable
+    best = np.inf
+    if not csq_entries:
+        return best
 
     for entry in csq_entries.split(','):
-        fields = entry.split('|')
-        if len(fields) <= gnomad_idx:
+        val = extract_field(entry, gnomad_idx)
+        if val is None:
             continue
-        val = fields[gnomad_idx]
-        if val in ('', '.', None):
-            return True
+        if val in ('', '.'):
+            return MISSING_AF
         try:
             af = float(val)
-            if af <= af_threshold:
-                return True
         except ValueError:
             continue
-    return False
+        if af < best:
+            best = af
+    return best
 
 # --------------------------------------------------------------------------- #
 # Core routine to flush (sub-)clusters
 # --------------------------------------------------------------------------- #
 
 def flush_cluster(
-    variants: List,
+    cluster: ClusterBuf,
     prev_nonshared_pos: int | None,
     next_nonshared_pos: int | None,
     *,
@@ -59,22 +183,24 @@ def flush_cluster(
     min_segment_length: int,
     max_segment_length: int,
     sample_ids: List[str],
-    gene_regions: list[tuple[str, int, int]],
-    gnomad_idx: int,
+    gene_index: dict[str, tuple[np.ndarray, np.ndarray]],
     min_ultra_rare: int,
     af_threshold: float
 ):
-    if not variants:
+    if len(cluster) == 0:
         return
 
-    individual_sets = [variant_carriers(v) for v in variants]
-    total_variants = len(individual_sets)
+    chrom = cluster.chrom
+    positions = cluster.positions
+    gts = cluster.gt_types
+    afs = cluster.afs
 
-    from collections import Counter
-    flat_list = [ind for s in individual_sets for ind in s]
-    count = Counter(flat_list)
+    carriers = variant_carriers(gts)
+    total_variants = len(positions)
+
+    counts = carriers.sum(axis=0, dtype=np.int32)
     threshold = int(0.8 * total_variants)
-    shared_inds = {i for i, c in count.items() if c >= threshold}
+    shared_inds = np.flatnonzero((counts >= threshold) & (counts > 0))
     n_shared = len(shared_inds)
 
     if n_shared < min_individuals:
@@ -82,50 +208,46 @@ def flush_cluster(
     if max_individuals is not None and n_shared > max_individuals:
         return
 
-    chrom = variants[0].CHROM
-    inds_str = ",".join(sample_ids[i] for i in sorted(shared_inds))
+    inds_str = ",".join(sample_ids[i] for i in shared_inds)
 
     # --- Segment by genotype mode ----------------------------------------- #
-    blocks: List[tuple[int, int, str]] = []
-    cur_mode: str | None = None
-    block_start = 0
+    mode_arr = shared_genotype_modes(gts, shared_inds)
+    b_starts, b_ends, b_modes = find_blocks(mode_arr)
+    segment_lengths, errs_left, errs_right = block_extents(
+        positions,
+        b_starts,
+        b_ends,
+        NO_FLANK if prev_nonshared_pos is None else prev_nonshared_pos,
+        NO_FLANK if next_nonshared_pos is None else next_nonshared_pos
+    )
 
-    for idx, v in enumerate(variants):
-        mode = "double" if all_shared_homozygous(v, shared_inds) else "single"
-        if cur_mode is None:
-            cur_mode = mode
-        elif mode != cur_mode:
-            blocks.append((block_start, idx - 1, cur_mode))
-            block_start = idx
-            cur_mode = mode
-    blocks.append((block_start, len(variants) - 1, cur_mode))
-
-    for b_start, b_end, mode in blocks:
-        block_vars = variants[b_start : b_end + 1]
-        segment_length = block_vars[-1].POS - block_vars[0].POS
-
-        if (len(block_vars) < min_variants or
+    for b in range(len(b_starts)):
+        b_start, b_end = int(b_starts[b]), int(b_ends[b])
+        n_block_vars = b_end - b_start + 1
+        segment_length = segment_lengths[b]
+
+        if (n_block_vars < min_variants or
             (min_segment_length is not None and segment_length < min_segment_length) or
             (max_segment_length is not None and segment_length > max_segment_length)):
             continue
 
-        start = block_vars[0].POS
-        end = block_vars[-1].POS
+        start = int(positions[b_start])
+        end = int(positions[b_end])
 
-        if not overlaps_gene_region(chrom, start, end, gene_regions):
+        if not overlaps_gene_region(chrom, start, end, gene_index):
             continue
 
-        n_ultra_rare = sum(is_ultra_rare_variant(v, gnomad_idx, af_threshold) for v in block_vars)
+        block_afs = afs[b_start : b_end + 1]
+        n_ultra_rare = int(((block_afs <= af_threshold) | (block_afs == MISSING_AF)).sum())
         if n_ultra_rare < min_ultra_rare:
             continue
 
-        left_flank = variants[b_start - 1].POS if b_start > 0 else prev_nonshared_pos
-        right_flank = variants[b_end + 1].POS if b_end + 1 < len(variants) else next_nonshared_pos
-        err_left = None if left_flank is None else start - left_flank
-        err_right = None if right_flank is None else right_flank - end
+        mode = "double" if b_modes[b] else "single"
+        err_left = None if errs_left[b] == NO_FLANK else int(errs_left[b])
+        err_right = None if errs_right[b] == NO_FLANK else int(errs_right[b])
 
         print(
-            f"{chrom}\t{start}\t{end}\t{len(block_vars)}\t{len(shared_inds)}\t{inds_str}"
+            f"{chrom}\t{start}\t{end}\t{n_block_vars}\t{len(shared_inds)}\t{inds_str}"
             f"\t{mode}\t{err_left}\t{err_right}\t{n_ultra_rare}\tULTRA_RARE"
         )
 
@@ -154,15 +276,11 @@ def main():
 
     gene_df = pd.read_csv(args.regions)
     BUFFER = 10000  # Add 10kb on either side
-    gene_regions = [
-    (
-        str(row["chromosome_name"]).lstrip("chr"),
-        max(0, int(row["start_position"]) - BUFFER),
-        int(row["end_position"]) + BUFFER
-    )
-    for _, row in gene_df.iterrows()
-]
-
+    chrom = gene_df["chromosome_name"].astype(str).str.lstrip("chr")
+    start = np.maximum(0, gene_df["start_position"].astype(np.int64) - BUFFER)
+    end = gene_df["end_position"].astype(np.int64) + BUFFER
+    gene_regions = list(zip(chrom.tolist(), start.tolist(), end.tolist()))
+    gene_index = build_gene_index(gene_regions)
 
     vcf = VCF(args.vcf)
     samples = vcf.samples
@@ -175,20 +293,20 @@ def main():
     except ValueError as e:
         raise RuntimeError(f"Required CSQ field 'GnomAD_v4_1_AF_popmax' not found in VCF header.") from e
 
-    current_cluster: List = []
+    cluster = ClusterBuf(len(samples))
     prev_nonshared_pos: int | None = None
     last_pos: int | None = None
 
     pbar = tqdm(vcf, desc="Scanning variants", unit="variants")
     for v in pbar:
         if last_pos is None:
-            current_cluster.append(v)
+            cluster.append(v.CHROM, v.POS, v.gt_types, extract_gnomad_af(v.INFO.get('CSQ', ''), gnomad_idx))
             last_pos = v.POS
             continue
 
-        if v.CHROM != current_cluster[0].CHROM:
+        if v.CHROM != cluster.chrom:
             flush_cluster(
-                current_cluster,
+                cluster,
                 prev_nonshared_pos,
                 None,
                 min_individuals=args.min_individuals,
@@ -197,23 +315,23 @@ def main():
                 min_segment_length=args.min_segment_length,
                 max_segment_length=args.max_segment_length,
                 sample_ids=samples,
-                gene_regions=gene_regions,
-                gnomad_idx=gnomad_idx,
+                gene_index=gene_index,
                 min_ultra_rare=args.min_ultra_rare, 
                 af_threshold=args.ultra_rare_threshold
             )
-            current_cluster = [v]
+            cluster.clear()
+            cluster.append(v.CHROM, v.POS, v.gt_types, extract_gnomad_af(v.INFO.get('CSQ', ''), gnomad_idx))
             last_pos = v.POS
             prev_nonshared_pos = None
             continue
 
         distance = v.POS - last_pos
         if distance <= args.cluster_distance:
-            current_cluster.append(v)
+            cluster.append(v.CHROM, v.POS, v.gt_types, extract_gnomad_af(v.INFO.get('CSQ', ''), gnomad_idx))
             last_pos = v.POS
         else:
             flush_cluster(
-                current_cluster,
+                cluster,
                 prev_nonshared_pos,
                 v.POS,
                 min_individuals=args.min_individuals,
@@ -222,17 +340,17 @@ def main():
                 min_segment_length=args.min_segment_length,
                 max_segment_length=args.max_segment_length,
                 sample_ids=samples,
-                gene_regions=gene_regions,
-                gnomad_idx=gnomad_idx,
+                gene_index=gene_index,
                 min_ultra_rare=args.min_ultra_rare,
                 af_threshold=args.ultra_rare_threshold
             )
-            prev_nonshared_pos = current_cluster[-1].POS
-            current_cluster = [v]
+            prev_nonshared_pos = last_pos
+            cluster.clear()
+            cluster.append(v.CHROM, v.POS, v.gt_types, extract_gnomad_af(v.INFO.get('CSQ', ''), gnomad_idx))
             last_pos = v.POS
 
     flush_cluster(
-        current_cluster,
+        cluster,
         prev_nonshared_pos,
         None,
         min_individuals=args.min_individuals,
@@ -241,8 +359,7 @@ def main():
         min_segment_length=args.min_segment_length,
         max_segment_length=args.max_segment_length,
         sample_ids=samples,
-        gene_regions=gene_regions,
-        gnomad_idx=gnomad_idx,
+        gene_index=gene_index,
         min_ultra_rare=args.min_ultra_rare,
         af_threshold=args.ultra_rare_threshold
     )
@@ -6,6 +6,18 @@ from glob import glob
 
 INPUT_FILES = "shared_regions_dist*_vars*_rare*_no_gene_filter.tsv"
 GNOMAD_THRESHOLD = 0.0001 
+def count_lines(path):
+    # Result files carry one region per line and no blank lines
+    n = 0
+    last = b'\n'
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b''):
+            n += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n':
+        n += 1  # last line has no trailing newline
+    return n
+
 def load_data():
     files = glob(INPUT_FILES)
     data = []
@@ -19,8 +31,7 @@ def load_data():
         }
         
         # Count regions 
-        with open(f) as fd:
-            regions = sum(1 for line in fd if line.strip())
+        regions = count_lines(f)
         
         data.append({**params, 'regions': regions})
     